@@ -1,13 +1,23 @@
 import os
 import sys
-import json
 import time
 import hmac
 import hashlib
-from datetime import datetime
-from typing import Dict, List, Optional
+import math
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import lru_cache, partial
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+import orjson
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from websockets.sync.client import connect as ws_connect
+import numpy as np
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -16,6 +26,8 @@ load_dotenv()
 # === Telegram 通知配置 ===
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+# 通知复用同一连接，连续发送时不再重复 TLS 握手
+_telegram_session = requests.Session()
 
 def send_telegram_message(message: str):
     """发送 Telegram 消息通知"""
@@ -31,12 +43,44 @@ def send_telegram_message(message: str):
             "parse_mode": "Markdown"
         }
         
-        resp = requests.post(url, data=data, timeout=10)
+        resp = _telegram_session.post(url, data=data, timeout=10)
+        if resp.status_code == 400:
+            # Markdown 解析失败时退回纯文本重发，不丢这条（可能是多条合并的）通知
+            data.pop("parse_mode")
+            resp = _telegram_session.post(url, data=data, timeout=10)
         return resp.status_code == 200
     except Exception as e:
         print(f"⚠️ Telegram 发送失败: {e}")
         return False
 
+
+_MARKDOWN_ESCAPE = str.maketrans({c: '\\' + c for c in '_*`['})
+
+
+def escape_markdown(text: str) -> str:
+    """转义 Telegram Markdown（旧版）特殊字符，用于把异常信息等原样嵌入通知"""
+    return text.translate(_MARKDOWN_ESCAPE)
+
+
+def split_message(parts: List[str], separator: str = "\n", limit: int = 4096) -> List[str]:
+    """按 separator 拼接 parts，切成不超过 Telegram 4096 字符上限的若干条；单个 part 不会被拆开（超长则截断）"""
+    chunks = []
+    current = ""
+    for part in parts:
+        part = part[:limit]
+        if current and len(current) + len(separator) + len(part) > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current}{separator}{part}" if current else part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_notifications(messages: List[str], limit: int = 4096) -> List[str]:
+    """把一轮的多条通知去重（保持顺序）后合并成尽量少的消息"""
+    return split_message(list(dict.fromkeys(messages)), "\n\n---\n\n", limit)
+
 # 订单配置文件路径
 ORDERS_FILE = Path(__file__).parent / "orders.json"
 
@@ -59,34 +103,232 @@ INTERVAL_MAP = {
 # 市场类型
 MARKET_TYPES = ['spot', 'futures']
 
+# 各周期对应秒数（1M 按 31 天计）
+INTERVAL_SECONDS = {
+    '15m': 15 * 60,
+    '1h': 60 * 60,
+    '4h': 4 * 60 * 60,
+    '1d': 24 * 60 * 60,
+    '1w': 7 * 24 * 60 * 60,
+    '1M': 31 * 24 * 60 * 60,
+}
+
+# K线缓存有效期（秒），同一轮检查内共用一次K线请求
+KLINES_CACHE_TTL = 30
+
+# 不带 symbol 的 openOrders 权重：合约 40、现货 80；带 symbol 时合约 1、现货 6。
+# 交易对数达到权重交叉点才改用批量请求，交易对少时逐个请求更省权重（逐单本就并发，延迟差别不大）
+BATCH_OPEN_ORDERS_MIN_SYMBOLS = {'futures': 40, 'spot': 14}
+
+# K线与订单推送都在线时，两次收盘之间的轮询改为每 5 分钟对账一次
+RECONCILE_INTERVAL = 300
+
+# 熔断：同一订单连续失败 3 次后暂停处理，暂停时长从 30 秒起翻倍，最长 5 分钟
+BREAKER_THRESHOLD = 3
+BREAKER_MAX_BACKOFF = 300
+
+# 杠杆/保证金模式缓存有效期（秒），很少变化，避免每次下单都查 positionRisk
+POSITION_RISK_TTL = 300
+
+# 磁盘缓存目录；exchangeInfo 一天内很少变化，重启后 6 小时内直接复用
+CACHE_DIR = Path(__file__).parent / ".cache"
+EXCHANGE_INFO_TTL = 6 * 60 * 60
+
+
+def _load_cached_json(path: Path, ttl: float, fetch_fn):
+    """读取未过期的磁盘缓存，否则调用 fetch_fn 获取并写回"""
+    try:
+        if time.time() - path.stat().st_mtime < ttl:
+            return orjson.loads(path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        pass
+    
+    data = fetch_fn()
+    try:
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(orjson.dumps(data))
+    except OSError as e:
+        print(f"⚠️ 写入缓存失败: {e}")
+    return data
+
+
+@lru_cache(maxsize=1024)
+def normalize_args(symbol: str, interval: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """用户输入的币种补全为 xxxUSDT，周期映射为币安格式（btc, 4H -> BTCUSDT, 4h）"""
+    symbol = symbol.upper()
+    if not symbol.endswith('USDT'):
+        symbol += 'USDT'
+    if interval is not None:
+        interval = INTERVAL_MAP.get(interval.lower(), interval)
+    return symbol, interval
+
+
+def _candle_end_ms(open_time: int, interval: str) -> Optional[int]:
+    """开盘时间为 open_time 的K线的收盘边界（即下一根的开盘时间，毫秒）；月线按自然月计算"""
+    if interval == '1M':
+        dt = datetime.fromtimestamp(open_time / 1000, tz=timezone.utc)
+        year, month = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+        return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    seconds = INTERVAL_SECONDS.get(interval)
+    return open_time + seconds * 1000 if seconds else None
+
+
+def _klines_limit(period: int) -> int:
+    """
+    计算 EMA 需要的K线数量：取 5 倍周期（至少 100 根，不超过接口上限）
+    首根收盘价种子的残余权重为 (1-k)^N，N=5×period 时约 e^-10，可忽略
+    """
+    return min(1500, max(period * 5, 100))
+
+
+def _emas_last(closes: np.ndarray, periods: List[int]) -> np.ndarray:
+    """
+    多个周期 EMA 的最后一个值（向量化）
+    与 pandas ewm(span=period, adjust=False) 一致：以首根收盘价为种子，
+    递推展开后即为 closes 与衰减权重的点积；多个周期拼成权重矩阵，一次矩阵乘法遍历 closes
+    """
+    n = len(closes)
+    k = 2.0 / (np.asarray(periods, dtype=np.float64) + 1)
+    exponents = np.arange(n - 1, -1, -1, dtype=np.float64)
+    weights = k[:, None] * (1.0 - k[:, None]) ** exponents
+    weights[:, 0] = (1.0 - k) ** (n - 1)
+    return weights @ closes
+
 
 class OrderManager:
     """订单配置管理"""
     
+    # 批量模式下的内存副本（None 表示不在批量模式）
+    _batch_orders: Optional[List[dict]] = None
+    _dirty = False
+    # 批量开始时的文件 stamp 与各订单副本，写盘时据此只回放本批次的改动
+    _batch_stamp: Optional[tuple] = None
+    _batch_base: Dict[str, dict] = {}
+    # 多线程并发处理订单时，读-改-写必须串行（可重入：update_order 内部还会 load/save）
+    _lock = threading.RLock()
+    # 已解析的订单及对应文件的 (mtime_ns, size)；文件未变时不重复读取解析
+    _cache: Optional[List[dict]] = None
+    _cache_stamp: Optional[tuple] = None
+    # 按市场/状态的订单数与 id 索引，订单有改动时作废
+    _counts: Optional[Dict[str, int]] = None
+    _index: Optional[Dict[str, dict]] = None
+    
+    @staticmethod
+    def _stamp() -> Optional[tuple]:
+        try:
+            st = ORDERS_FILE.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    
     @staticmethod
     def load_orders() -> List[dict]:
-        if ORDERS_FILE.exists():
-            with open(ORDERS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
+        if OrderManager._batch_orders is not None:
+            return OrderManager._batch_orders
+        with OrderManager._lock:
+            stamp = OrderManager._stamp()
+            if stamp is None:
+                return []
+            if OrderManager._cache is None or stamp != OrderManager._cache_stamp:
+                OrderManager._cache = orjson.loads(ORDERS_FILE.read_bytes())
+                OrderManager._cache_stamp = stamp
+                OrderManager._counts = None
+                OrderManager._index = None
+            return OrderManager._cache
     
     @staticmethod
     def save_orders(orders: List[dict]):
-        with open(ORDERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(orders, f, indent=2, ensure_ascii=False)
+        with OrderManager._lock:
+            OrderManager._counts = None
+            OrderManager._index = None
+            if OrderManager._batch_orders is not None:
+                OrderManager._batch_orders = orders
+                OrderManager._dirty = True
+                return
+            OrderManager._write(orders)
+    
+    @staticmethod
+    def _write(orders: List[dict]):
+        # 状态文件由程序读写，紧凑输出；先写临时文件再原子替换，崩溃不会留下半个文件
+        tmp = ORDERS_FILE.with_suffix('.json.tmp')
+        tmp.write_bytes(orjson.dumps(orders, option=orjson.OPT_APPEND_NEWLINE))
+        os.replace(tmp, ORDERS_FILE)
+        OrderManager._cache = orders
+        OrderManager._cache_stamp = OrderManager._stamp()
+        OrderManager._counts = None
+        OrderManager._index = None
+    
+    @staticmethod
+    def _replay_batch(orders: List[dict]) -> List[dict]:
+        """
+        批量期间文件被其他进程改过（如 CLI remove）：重新读盘，只回放本批次按 id 的增、删、改，
+        不用内存副本整体覆盖；本批次改过但盘上已不存在的订单跳过
+        """
+        base = OrderManager._batch_base
+        current = {o['id']: o for o in orders}
+        removed = base.keys() - current.keys()
+        changes = {}
+        for order_id, o in current.items():
+            old = base.get(order_id)
+            if old is not None:
+                changed = {k: v for k, v in o.items() if old.get(k) != v}
+                if changed:
+                    changes[order_id] = changed
+        
+        disk = orjson.loads(ORDERS_FILE.read_bytes()) if ORDERS_FILE.exists() else []
+        merged = []
+        for o in disk:
+            if o['id'] in removed:
+                continue
+            o.update(changes.get(o['id'], {}))
+            merged.append(o)
+        disk_ids = {o['id'] for o in disk}
+        merged.extend(o for order_id, o in current.items() if order_id not in base and order_id not in disk_ids)
+        return merged
+    
+    @staticmethod
+    def flush():
+        """把批量模式下的改动写盘（无改动则跳过）"""
+        with OrderManager._lock:
+            if OrderManager._batch_orders is not None and OrderManager._dirty:
+                orders = OrderManager._batch_orders
+                if OrderManager._stamp() != OrderManager._batch_stamp:
+                    orders = OrderManager._replay_batch(orders)
+                OrderManager._write(orders)
+            OrderManager._dirty = False
+    
+    @staticmethod
+    @contextmanager
+    def batch():
+        """批量修改：期间只读写内存副本，退出时统一写盘一次"""
+        if OrderManager._batch_orders is not None:
+            yield
+            return
+        
+        with OrderManager._lock:
+            orders = OrderManager.load_orders()
+            OrderManager._batch_stamp = OrderManager._stamp()
+            OrderManager._batch_base = {o['id']: dict(o) for o in orders}
+            OrderManager._batch_orders = orders
+            OrderManager._dirty = False
+        try:
+            yield
+        finally:
+            with OrderManager._lock:
+                # 写盘失败照常抛出，但无论如何都要退出批量模式，否则之后的改动永远只停在内存
+                try:
+                    OrderManager.flush()
+                finally:
+                    OrderManager._batch_orders = None
+                    OrderManager._batch_base = {}
+                    OrderManager._dirty = False
     
     @staticmethod
     def add_order(symbol: str, interval: str, ema: int, side: str, quantity: float, 
                   leverage: int = None, margin_type: str = None, position_side: str = None,
                   market_type: str = 'futures') -> dict:
         """添加新订单追踪"""
-        orders = OrderManager.load_orders()
-        
-        symbol = symbol.upper()
-        if not symbol.endswith('USDT'):
-            symbol = symbol + 'USDT'
-        
-        interval = INTERVAL_MAP.get(interval.lower(), interval)
+        symbol, interval = normalize_args(symbol, interval)
         
         if ema not in SUPPORTED_EMA:
             raise ValueError(f"EMA必须是 {SUPPORTED_EMA} 之一")
@@ -103,56 +345,84 @@ class OrderManager:
         market_prefix = "SPOT" if market_type == 'spot' else "FUT"
         order_id = f"{market_prefix}_{symbol}_{interval}_EMA{ema}_{side}"
         
-        for o in orders:
-            if o['id'] == order_id:
+        with OrderManager._lock:
+            if OrderManager.get_order(order_id):
                 raise ValueError(f"订单已存在: {order_id}")
+            orders = OrderManager.load_orders()
         
-        new_order = {
-            'id': order_id,
-            'symbol': symbol,
-            'interval': interval,
-            'ema': ema,
-            'side': side,
-            'quantity': quantity,
-            'binance_order_id': None,
-            'status': 'active',
-            'created_at': datetime.now().isoformat(),
-            'market_type': market_type,  # 新增：市场类型
-            'leverage': leverage if market_type == 'futures' else None,
-            'margin_type': margin_type if market_type == 'futures' else None,
-            'position_side': position_side if market_type == 'futures' else None,
-            'notified_error': False
-        }
+            new_order = {
+                'id': order_id,
+                'symbol': symbol,
+                'interval': interval,
+                'ema': ema,
+                'side': side,
+                'quantity': quantity,
+                'binance_order_id': None,
+                'status': 'active',
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'market_type': market_type,  # 新增：市场类型
+                'leverage': leverage if market_type == 'futures' else None,
+                'margin_type': margin_type if market_type == 'futures' else None,
+                'position_side': position_side if market_type == 'futures' else None,
+                'notified_error': False
+            }
         
-        orders.append(new_order)
-        OrderManager.save_orders(orders)
-        return new_order
+            orders.append(new_order)
+            OrderManager.save_orders(orders)
+            return new_order
     
     @staticmethod
     def remove_order(order_id: str) -> bool:
         """移除订单追踪"""
-        orders = OrderManager.load_orders()
-        new_orders = [o for o in orders if o['id'] != order_id]
-        
-        if len(new_orders) < len(orders):
-            OrderManager.save_orders(new_orders)
+        with OrderManager._lock:
+            target = OrderManager.get_order(order_id)
+            if target is None:
+                return False
+            # 生成新列表而不是原地删除，其他线程手里的旧列表不受影响
+            OrderManager.save_orders([o for o in OrderManager.load_orders() if o is not target])
             return True
-        return False
     
     @staticmethod
     def list_orders() -> List[dict]:
         return OrderManager.load_orders()
     
     @staticmethod
-    def update_order(order_id: str, **kwargs):
-        """更新订单信息"""
-        orders = OrderManager.load_orders()
-        for o in orders:
-            if o['id'] == order_id:
-                for key, value in kwargs.items():
-                    o[key] = value
-                break
-        OrderManager.save_orders(orders)
+    def get_order(order_id: str) -> Optional[dict]:
+        """按 id 取订单（字典索引）"""
+        with OrderManager._lock:
+            orders = OrderManager.load_orders()
+            if OrderManager._index is None:
+                OrderManager._index = {o['id']: o for o in orders}
+            return OrderManager._index.get(order_id)
+    
+    @staticmethod
+    def counts() -> Dict[str, int]:
+        """订单数：spot / futures / active_spot / active_futures"""
+        with OrderManager._lock:
+            orders = OrderManager.load_orders()
+            if OrderManager._counts is None:
+                counts = {'spot': 0, 'futures': 0, 'active_spot': 0, 'active_futures': 0}
+                for o in orders:
+                    market_type = 'spot' if o.get('market_type') == 'spot' else 'futures'
+                    counts[market_type] += 1
+                    if o.get('status') == 'active':
+                        counts['active_' + market_type] += 1
+                OrderManager._counts = counts
+            return dict(OrderManager._counts)
+    
+    @staticmethod
+    def update_order(order_id: str, **kwargs) -> bool:
+        """更新订单信息；订单已不在追踪（例如处理期间被删除）时返回 False"""
+        with OrderManager._lock:
+            order = OrderManager.get_order(order_id)
+            if order is None:
+                return False
+            order.update(kwargs)
+            # 只改字段不增删订单，保存后 id 索引仍然有效
+            index = OrderManager._index
+            OrderManager.save_orders(OrderManager.load_orders())
+            OrderManager._index = index
+            return True
     
     @staticmethod
     def update_binance_order_id(order_id: str, binance_order_id: int):
@@ -175,6 +445,8 @@ class BinanceClient:
         
         self.api_key = self.api_key.strip()
         self.api_secret = self.api_secret.strip()
+        # 预先完成 HMAC 密钥编排，每次签名只需 copy
+        self._hmac_proto = hmac.new(self.api_secret.encode('utf-8'), digestmod=hashlib.sha256)
         
         # 合约API
         self.futures_base_url = "https://fapi.binance.com"
@@ -183,15 +455,45 @@ class BinanceClient:
         
         self.session = requests.Session()
         self.session.headers.update({
-            'X-MBX-APIKEY': self.api_key
+            'X-MBX-APIKEY': self.api_key,
+            'Connection': 'keep-alive'
         })
+        # 连接池复用 TCP+TLS 连接；只对 GET 做自动重试，下单/撤单不重放
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset(['GET'])
+            )
+        )
+        self.session.mount('https://', adapter)
 
         self.time_offset = 0
         self._sync_time()
         
-        self._futures_exchange_info = None
-        self._spot_exchange_info = None
+        # exchangeInfo 索引: market_type -> {symbol: info}
+        self._symbol_maps: Dict[str, dict] = {}
+        self._symbol_maps_fetched = set()
+        # 精度缓存: (market_type, symbol) -> (tick_size, price_precision, step_size, qty_precision)
+        self._precision_cache: Dict[tuple, tuple] = {}
         self._position_mode = None
+        # positionRisk 缓存: symbol -> (拉取时间, leverage, margin_type)
+        self._position_risk_cache: Dict[str, tuple] = {}
+        # K线缓存: (market_type, symbol, interval) -> (更新时间, 收盘价数组, 最后一根已收盘K线开盘时间)
+        self._klines_cache: Dict[tuple, tuple] = {}
+        # (market_type, symbol, interval, period) -> (ema, 最后一根已收盘K线的开盘时间)
+        self._ema_cache: Dict[tuple, tuple] = {}
+        # 推送线程与请求线程都会追加K线，读-改-写需串行
+        self._klines_lock = threading.Lock()
+        # K线推送: market_type -> KlineStream；on_kline_closed 在收到收盘K线或推送（重）连上时回调
+        self._kline_streams: Dict[str, 'KlineStream'] = {}
+        self.on_kline_closed = None
+        # 合约订单推送；on_order_update 在挂单进入终态或推送（重）连上时回调
+        self._order_stream: Optional['UserDataStream'] = None
+        self.on_order_update = None
     
     def _sync_time(self):
         """同步服务器时间"""
@@ -199,7 +501,7 @@ class BinanceClient:
             # 使用现货API同步时间（更通用）
             url = f"{self.spot_base_url}/api/v3/time"
             resp = self.session.get(url, timeout=10)
-            server_time = resp.json()['serverTime']
+            server_time = self._json(resp)['serverTime']
             local_time = int(time.time() * 1000)
             self.time_offset = server_time - local_time
             print(f"⏱️ 服务器时间偏移: {self.time_offset}ms")
@@ -207,16 +509,19 @@ class BinanceClient:
             print(f"⚠️ 时间同步失败: {e}")
             self.time_offset = 0
     
+    @staticmethod
+    def _json(resp):
+        """用 orjson 直接解析响应字节（K线、exchangeInfo 等大响应明显更快）"""
+        return orjson.loads(resp.content)
+    
     def _sign(self, params: dict) -> str:
         """签名并返回完整的 query string"""
         params['timestamp'] = int(time.time() * 1000) + self.time_offset
         params['recvWindow'] = 10000
-        query_string = '&'.join(f"{k}={v}" for k, v in params.items())
-        signature = hmac.new(
-            self.api_secret.encode('utf-8'),
-            query_string.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        query_string = urlencode(params)
+        mac = self._hmac_proto.copy()
+        mac.update(query_string.encode('utf-8'))
+        signature = mac.hexdigest()
         return f"{query_string}&signature={signature}"
     
     def _get_base_url(self, market_type: str) -> str:
@@ -228,69 +533,94 @@ class BinanceClient:
 
     # ==================== 交易对信息 ====================
     
-    def get_symbol_info(self, symbol: str, market_type: str = 'futures') -> dict:
-        """获取交易对精度信息（带缓存）"""
+    def _fetch_symbol_map(self, market_type: str, symbol: str = None) -> dict:
+        """拉取 exchangeInfo 并按 symbol 建索引（现货可只拉单个交易对）"""
         if market_type == 'spot':
-            if not self._spot_exchange_info:
-                url = f"{self.spot_base_url}/api/v3/exchangeInfo"
-                resp = self.session.get(url, timeout=10)
-                resp.raise_for_status()
-                self._spot_exchange_info = resp.json()
-            
-            for s in self._spot_exchange_info['symbols']:
-                if s['symbol'] == symbol:
-                    return s
+            url = f"{self.spot_base_url}/api/v3/exchangeInfo"
         else:
-            if not self._futures_exchange_info:
-                url = f"{self.futures_base_url}/fapi/v1/exchangeInfo"
-                resp = self.session.get(url, timeout=10)
-                resp.raise_for_status()
-                self._futures_exchange_info = resp.json()
-            
-            for s in self._futures_exchange_info['symbols']:
-                if s['symbol'] == symbol:
-                    return s
-        return None
+            url = f"{self.futures_base_url}/fapi/v1/exchangeInfo"
+        
+        params = {'symbol': symbol} if symbol else None
+        resp = self.session.get(url, params=params, timeout=10)
+        resp.raise_for_status()
+        if not symbol:
+            self._symbol_maps_fetched.add(market_type)
+        return {s['symbol']: s for s in self._json(resp)['symbols']}
+
+    def get_symbol_info(self, symbol: str, market_type: str = 'futures') -> dict:
+        """获取交易对精度信息（带缓存，按 symbol 建索引）"""
+        if market_type == 'spot':
+            # 现货 exchangeInfo 支持按交易对查询：只拉需要的那一个，不下载全量文档
+            symbol_map = self._symbol_maps.setdefault(market_type, {})
+            if symbol not in symbol_map:
+                try:
+                    symbol_map.update(self._fetch_symbol_map(market_type, symbol))
+                except requests.HTTPError:
+                    return None
+            return symbol_map.get(symbol)
+        
+        # 合约 exchangeInfo 不支持按交易对过滤，全量索引走磁盘缓存
+        cache_path = CACHE_DIR / f"exchange_info_{market_type}.json"
+        fetch = partial(self._fetch_symbol_map, market_type)
+        
+        if market_type not in self._symbol_maps:
+            self._symbol_maps[market_type] = _load_cached_json(cache_path, EXCHANGE_INFO_TTL, fetch)
+        
+        info = self._symbol_maps[market_type].get(symbol)
+        if info is None and market_type not in self._symbol_maps_fetched:
+            # 磁盘缓存可能早于新交易对上线，未命中时从网络刷新一次
+            self._symbol_maps[market_type] = _load_cached_json(cache_path, 0, fetch)
+            info = self._symbol_maps[market_type].get(symbol)
+        return info
+
+    @staticmethod
+    def _step_precision(step: str) -> int:
+        """步长对应的小数位数（直接由接口返回的十进制字符串得出，如 '0.01000000' -> 2）"""
+        return max(0, -Decimal(step).normalize().as_tuple().exponent)
+
+    def _get_precision(self, symbol: str, market_type: str = 'futures') -> tuple:
+        """
+        交易对精度（按 市场+交易对 缓存）
+        返回 (tick_size, price_precision, step_size, qty_precision)，缺失的过滤器对应项为 None
+        """
+        key = (market_type, symbol)
+        if key in self._precision_cache:
+            return self._precision_cache[key]
+        
+        tick_size = price_precision = step_size = qty_precision = None
+        info = self.get_symbol_info(symbol, market_type)
+        if info:
+            for f in info['filters']:
+                if f['filterType'] == 'PRICE_FILTER' and tick_size is None:
+                    tick_size = float(f['tickSize'])
+                    price_precision = self._step_precision(f['tickSize'])
+                elif f['filterType'] == 'LOT_SIZE' and step_size is None:
+                    step_size = float(f['stepSize'])
+                    qty_precision = self._step_precision(f['stepSize'])
+        
+        precision = (tick_size, price_precision, step_size, qty_precision)
+        if info:
+            self._precision_cache[key] = precision
+        return precision
 
     def format_price(self, symbol: str, price: float, market_type: str = 'futures') -> str:
         """根据交易对规则格式化价格"""
-        info = self.get_symbol_info(symbol, market_type)
-        if not info:
+        tick_size, precision, _, _ = self._get_precision(symbol, market_type)
+        if tick_size is None:
             return f"{price:.2f}"
         
-        for f in info['filters']:
-            if f['filterType'] == 'PRICE_FILTER':
-                tick_size = float(f['tickSize'])
-                
-                if tick_size >= 1:
-                    precision = 0
-                else:
-                    precision = len(str(tick_size).rstrip('0').split('.')[-1])
-                
-                price = (price // tick_size) * tick_size
-                return f"{price:.{precision}f}"
-        
-        return f"{price:.2f}"
+        # 按整数个 tick 向下取整；加极小量避免 0.3/0.1=2.999... 这类误差少算一格
+        price = math.floor(price / tick_size + 1e-9) * tick_size
+        return f"{price:.{precision}f}"
 
     def format_quantity(self, symbol: str, quantity: float, market_type: str = 'futures') -> str:
         """根据交易对规则格式化数量"""
-        info = self.get_symbol_info(symbol, market_type)
-        if not info:
+        _, _, step_size, precision = self._get_precision(symbol, market_type)
+        if step_size is None:
             return str(quantity)
         
-        for f in info['filters']:
-            if f['filterType'] == 'LOT_SIZE':
-                step_size = float(f['stepSize'])
-                
-                if step_size >= 1:
-                    precision = 0
-                else:
-                    precision = len(str(step_size).rstrip('0').split('.')[-1])
-                
-                quantity = (quantity // step_size) * step_size
-                return f"{quantity:.{precision}f}"
-        
-        return str(quantity)
+        quantity = math.floor(quantity / step_size + 1e-9) * step_size
+        return f"{quantity:.{precision}f}"
 
     # ==================== 价格查询 ====================
     
@@ -304,14 +634,27 @@ class BinanceClient:
         params = {'symbol': symbol}
         resp = self.session.get(url, params=params)
         resp.raise_for_status()
-        return float(resp.json()['price'])
+        return float(self._json(resp)['price'])
 
     # ==================== EMA 计算 ====================
     
-    def calculate_ema(self, symbol: str, period: int, interval: str, market_type: str = 'futures') -> float:
+    def _closes_fresh(self, key: tuple, cached: tuple) -> bool:
         """
-        计算 EMA（优化版，更接近币安图表）
+        缓存是否仍可用：已收盘K线只会在下一根K线收盘时变化，
+        因此在最后一根已收盘K线之后那根收盘前都有效（有推送时多留 60 秒等推送追加）
         """
+        market_type, symbol, interval = key
+        next_open = _candle_end_ms(cached[2], interval)
+        next_close = _candle_end_ms(next_open, interval) if next_open else None
+        if next_close is None:
+            return time.monotonic() - cached[0] < KLINES_CACHE_TTL
+        
+        stream = self._kline_streams.get(market_type)
+        grace = 60_000 if stream and stream.is_live(symbol, interval) else 0
+        return int(time.time() * 1000) + self.time_offset < next_close + grace
+
+    def _fetch_klines(self, symbol: str, interval: str, market_type: str, limit: int) -> Optional[list]:
+        """请求 /klines 原始数据，失败返回 None"""
         if market_type == 'spot':
             base_url = self.spot_base_url
             endpoint = "/api/v3/klines"
@@ -320,50 +663,224 @@ class BinanceClient:
             endpoint = "/fapi/v1/klines"
             
         url = f"{base_url}{endpoint}"
-        limit = 1500
         params = {'symbol': symbol, 'interval': interval, 'limit': limit}
         
         try:
             resp = self.session.get(url, params=params, timeout=10)
             resp.raise_for_status()
-            klines = resp.json()
+            return self._json(resp)
         except Exception as e:
             print(f"⚠️ 获取K线失败: {e}")
-            return 0.0
+            return None
+
+    def _get_closes(self, symbol: str, interval: str, market_type: str = 'futures',
+                    limit: int = 1500) -> Optional[np.ndarray]:
+        """获取已收盘K线的收盘价（按 市场+交易对+周期 缓存，已缓存的根数不少于 limit 时复用）"""
+        key = (market_type, symbol, interval)
+        cached = self._klines_cache.get(key)
+        if cached and cached[3] >= limit:
+            if self._closes_fresh(key, cached):
+                return cached[1]
+            # 缓存过期时只拉取缓存之后的少量K线追加，接不上再整段重拉
+            closes = self._refresh_tail(key, cached)
+            if closes is not None:
+                return closes
         
+        klines = self._fetch_klines(symbol, interval, market_type, limit)
         if not klines or len(klines) == 0:
-            return 0.0
+            return None
+        
+        # 收盘价字符串交给 NumPy 在 C 层转换，省去逐个 float()
+        closes = np.array([k[4] for k in klines], dtype=np.float64)
         
-        # 排除最后一根未完成的K线
-        if len(klines) > 1:
-            klines = klines[:-1]
+        # 排除最后一根未完成的K线（切片为视图，不复制）
+        last = len(klines) - 1 if len(klines) > 1 else 0
+        closes = closes[:last + 1]
+        self._klines_cache[key] = (time.monotonic(), closes, int(klines[last][0]), limit)
+        return closes
+
+    def _refresh_tail(self, key: tuple, cached: tuple) -> Optional[np.ndarray]:
+        """按缓存后经过的K线数（+2）拉取尾部并追加；缺口太大或不连续时返回 None"""
+        market_type, symbol, interval = key
+        seconds = INTERVAL_SECONDS.get(interval)
+        if not seconds:
+            return None
+        
+        now = int(time.time() * 1000) + self.time_offset
+        missing = (now - cached[2]) // (seconds * 1000)
+        if missing > 100:
+            return None
         
-        closes = [float(k[4]) for k in klines]
+        klines = self._fetch_klines(symbol, interval, market_type, int(missing) + 2)
+        if not klines:
+            return None
         
-        if len(closes) < period:
-            return 0.0
+        # 最后一根为未完成K线
+        new = [(int(k[0]), float(k[4])) for k in klines[:-1] if int(k[0]) > cached[2]]
+        if not new:
+            self._klines_cache[key] = (time.monotonic(),) + cached[1:]
+            return cached[1]
+        if not self._append_closes(key, new):
+            return None
+        return self._klines_cache[key][1]
+
+    def _append_closes(self, key: tuple, new: List[tuple]) -> bool:
+        """
+        把按时间排列的 (open_time, close) 滚动追加到缓存，并对已缓存的 EMA 逐根递推：
+        ema = k*close + (1-k)*ema，每根新K线只需一次乘加；K线不连续时丢弃缓存并返回 False
+        """
+        with self._klines_lock:
+            cached = self._klines_cache.get(key)
+            if not cached:
+                return False
+            _, closes, last_open_time, limit = cached
+            new = [(open_time, close) for open_time, close in new if open_time > last_open_time]
+            if not new:
+                return True
+            if new[0][0] != _candle_end_ms(last_open_time, key[2]):
+                self._klines_cache.pop(key, None)
+                return False
+            
+            # 历史不足 limit-1 根（新上线的交易对）时先增长，之后保持长度滚动
+            values = np.array([close for _, close in new], dtype=np.float64)
+            size = max(len(closes), min(len(closes) + len(values), limit - 1))
+            closes = np.concatenate((closes, values))[-size:]
+            new_open_time = new[-1][0]
+            self._klines_cache[key] = (time.monotonic(), closes, new_open_time, limit)
+            
+            for period in SUPPORTED_EMA:
+                ema_key = key + (period,)
+                ema_cached = self._ema_cache.get(ema_key)
+                if ema_cached and ema_cached[1] == last_open_time:
+                    k = 2.0 / (period + 1)
+                    ema = ema_cached[0]
+                    for value in values.tolist():
+                        ema = k * value + (1 - k) * ema
+                    self._ema_cache[ema_key] = (ema, new_open_time)
+            return True
+
+    def watch_klines(self, keys: List[tuple]):
+        """
+        订阅K线推送，keys 为 (market_type, symbol, interval)
+        收盘K线直接追加进缓存，稳态下不再请求 /klines
+        """
+        by_market = {market_type: set() for market_type in MARKET_TYPES}
+        for market_type, symbol, interval in keys:
+            by_market[market_type].add((symbol, interval))
         
-        # ✅ 使用 pandas ewm（与币安/TradingView 更接近）
-        df = pd.DataFrame({'close': closes})
-        ema_series = df['close'].ewm(span=period, adjust=False).mean()
+        for market_type, market_keys in by_market.items():
+            stream = self._kline_streams.get(market_type)
+            if stream is None:
+                if not market_keys:
+                    continue
+                stream = KlineStream(market_type, self._on_kline_closed, self._on_stream_connected)
+                self._kline_streams[market_type] = stream
+            stream.subscribe(market_keys)
+
+    def _on_stream_connected(self, market_type: str):
+        """
+        推送（重）连上后，断线期间可能漏掉收盘K线，丢弃该市场缓存重新拉取；
+        以 (market_type, None, None) 回调 on_kline_closed，让下一轮检查立即用 REST 补上
+        """
+        for key in list(self._klines_cache):
+            if key[0] == market_type:
+                self._klines_cache.pop(key, None)
+        if self.on_kline_closed:
+            self.on_kline_closed(market_type, None, None)
+
+    def _on_kline_closed(self, market_type: str, symbol: str, interval: str, open_time: int, close: float):
+        """
+        收到收盘K线：滚动追加到缓存；缓存为空或K线不连续时交给 REST 重新拉取，
+        两种情况都照样回调，收盘后的重新定价不必等对账周期
+        """
+        key = (market_type, symbol, interval)
+        cached = self._klines_cache.get(key)
+        if cached and open_time <= cached[2]:
+            return
+        if cached:
+            self._append_closes(key, [(open_time, close)])
+        if self.on_kline_closed:
+            self.on_kline_closed(market_type, symbol, interval)
+
+    def watch_orders(self):
+        """订阅合约用户数据流，挂单成交/撤销即时推送，不必靠轮询发现"""
+        if self._order_stream is None:
+            self._order_stream = UserDataStream(self, self._on_order_update)
+            self._order_stream.start()
+
+    def _on_order_update(self, symbol: Optional[str], order_id: Optional[int], status: Optional[str]):
+        if self.on_order_update:
+            self.on_order_update(symbol, order_id, status)
+
+    def streams_cover(self, keys: List[tuple]) -> bool:
+        """
+        keys 涉及的K线推送与订单推送是否都在线
+        现货没有订单推送，含现货订单时始终返回 False
+        """
+        for market_type, symbol, interval in keys:
+            stream = self._kline_streams.get(market_type)
+            if market_type == 'spot' or not stream or not stream.is_live(symbol, interval):
+                return False
+        return bool(keys) and self._order_stream is not None and self._order_stream.live
+
+    def prefetch_closes(self, limits: Dict[tuple, int], max_workers: int = 8):
+        """并发预取多组K线填充缓存，limits 为 {(market_type, symbol, interval): K线数量}"""
+        if not limits:
+            return
         
-        return ema_series.iloc[-1]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(limits))) as executor:
+            list(executor.map(lambda item: self._get_closes(item[0][1], item[0][2], item[0][0], item[1]),
+                              limits.items()))
 
-        # ==================== 账户余额 ====================
+    def calculate_emas(self, symbol: str, periods: List[int], interval: str,
+                       market_type: str = 'futures') -> Dict[int, float]:
+        """一次K线请求计算多个周期的 EMA（数据不足的周期为 0.0）"""
+        key = (market_type, symbol, interval)
+        closes = self._get_closes(symbol, interval, market_type, _klines_limit(max(periods)))
+        result = {period: 0.0 for period in periods}
+        if closes is None:
+            return result
         
-    def get_account_balance(self, market_type: str = 'futures') -> dict:
-        """获取账户余额"""
+        # 最后一根收盘K线没变的周期直接用缓存的 EMA，其余整段重算后写回缓存
+        cached = self._klines_cache.get(key)
+        # 推送线程可能已换入新数组，时间戳与 closes 对不上时不读写 EMA 缓存
+        last_open_time = cached[2] if cached and cached[1] is closes else None
+        missing = []
+        for period in periods:
+            ema_cached = self._ema_cache.get(key + (period,))
+            if ema_cached and ema_cached[1] == last_open_time:
+                result[period] = ema_cached[0]
+            elif len(closes) >= period:
+                missing.append(period)
+        
+        if missing:
+            for period, ema in zip(missing, _emas_last(closes, missing).tolist()):
+                result[period] = ema
+                if last_open_time is not None:
+                    self._ema_cache[key + (period,)] = (ema, last_open_time)
+        return result
+
+    def calculate_ema(self, symbol: str, period: int, interval: str, market_type: str = 'futures') -> float:
+        """
+        计算 EMA（优化版，更接近币安图表）
+        """
+        return self.calculate_emas(symbol, [period], interval, market_type)[period]
+
+    # ==================== 账户余额 ====================
+    
+    def get_account_balance(self, market_type: str = 'futures', min_amount: float = 1e-4) -> dict:
+        """获取账户余额（不超过 min_amount 的零头在这里直接丢弃）"""
         if market_type == 'spot':
             url = f"{self.spot_base_url}/api/v3/account"
             query_string = self._sign({})
             resp = self.session.get(f"{url}?{query_string}")
             resp.raise_for_status()
-            data = resp.json()
+            data = self._json(resp)
             
             balances = {}
             for asset in data.get('balances', []):
                 free = float(asset['free'])
-                if free > 0:
+                if free > min_amount:
                     balances[asset['asset']] = free
             return balances
         else:
@@ -371,12 +888,14 @@ class BinanceClient:
             query_string = self._sign({})
             resp = self.session.get(f"{url}?{query_string}")
             resp.raise_for_status()
-            data = resp.json()
+            data = self._json(resp)
             
             balances = {}
             for asset in data:
                 if asset['asset'] == 'USDT':
-                    balances['USDT'] = float(asset['availableBalance'])
+                    available = float(asset['availableBalance'])
+                    if available > min_amount:
+                        balances['USDT'] = available
                     break
             return balances
 
@@ -391,19 +910,32 @@ class BinanceClient:
         query_string = self._sign({})
         resp = self.session.get(f"{url}?{query_string}")
         resp.raise_for_status()
-        self._position_mode = resp.json().get('dualSidePosition', False)
+        self._position_mode = self._json(resp).get('dualSidePosition', False)
         return self._position_mode
 
-    def get_leverage(self, symbol: str) -> int:
-        """获取交易对当前杠杆倍数（仅合约）"""
+    def _get_position_risk(self, symbol: str) -> tuple:
+        """杠杆与保证金模式（同一 positionRisk 请求，按 symbol 缓存 POSITION_RISK_TTL 秒）"""
+        cached = self._position_risk_cache.get(symbol)
+        if cached and time.monotonic() - cached[0] < POSITION_RISK_TTL:
+            return cached[1], cached[2]
+        
         url = f"{self.futures_base_url}/fapi/v2/positionRisk"
         query_string = self._sign({'symbol': symbol})
         resp = self.session.get(f"{url}?{query_string}")
         resp.raise_for_status()
-        data = resp.json()
+        data = self._json(resp)
         if data:
-            return int(data[0].get('leverage', 20))
-        return 20
+            leverage = int(data[0].get('leverage', 20))
+            margin_type = data[0].get('marginType', 'cross').upper()
+        else:
+            leverage, margin_type = 20, 'CROSS'
+        
+        self._position_risk_cache[symbol] = (time.monotonic(), leverage, margin_type)
+        return leverage, margin_type
+
+    def get_leverage(self, symbol: str) -> int:
+        """获取交易对当前杠杆倍数（仅合约）"""
+        return self._get_position_risk(symbol)[0]
 
     def set_leverage(self, symbol: str, leverage: int):
         """设置杠杆倍数（仅合约）"""
@@ -415,18 +947,15 @@ class BinanceClient:
         query_string = self._sign(params)
         resp = self.session.post(f"{url}?{query_string}")
         resp.raise_for_status()
-        return resp.json()
+        
+        cached = self._position_risk_cache.get(symbol)
+        if cached:
+            self._position_risk_cache[symbol] = (cached[0], leverage, cached[2])
+        return self._json(resp)
 
     def get_margin_type(self, symbol: str) -> str:
         """获取保证金模式（仅合约）"""
-        url = f"{self.futures_base_url}/fapi/v2/positionRisk"
-        query_string = self._sign({'symbol': symbol})
-        resp = self.session.get(f"{url}?{query_string}")
-        resp.raise_for_status()
-        data = resp.json()
-        if data:
-            return data[0].get('marginType', 'cross').upper()
-        return 'CROSS'
+        return self._get_position_risk(symbol)[1]
 
     def set_margin_type(self, symbol: str, margin_type: str):
         """设置保证金模式（仅合约）"""
@@ -438,9 +967,26 @@ class BinanceClient:
         query_string = self._sign(params)
         resp = self.session.post(f"{url}?{query_string}")
         if resp.status_code == 200:
-            return resp.json()
+            cached = self._position_risk_cache.get(symbol)
+            if cached:
+                current = 'CROSS' if margin_type.upper().startswith('CROSS') else margin_type.upper()
+                self._position_risk_cache[symbol] = (cached[0], cached[1], current)
+            return self._json(resp)
         return None
 
+    # ==================== 用户数据流 ====================
+
+    def new_listen_key(self) -> str:
+        """创建合约用户数据流 listenKey（已存在时返回同一个并延长有效期）"""
+        resp = self.session.post(f"{self.futures_base_url}/fapi/v1/listenKey", timeout=10)
+        resp.raise_for_status()
+        return self._json(resp)['listenKey']
+
+    def keepalive_listen_key(self):
+        """延长 listenKey 有效期（60 分钟内未延长会失效）"""
+        resp = self.session.put(f"{self.futures_base_url}/fapi/v1/listenKey", timeout=10)
+        resp.raise_for_status()
+
     # ==================== 订单管理 ====================
 
     def get_open_orders(self, symbol: str, market_type: str = 'futures') -> list:
@@ -453,7 +999,23 @@ class BinanceClient:
         query_string = self._sign({'symbol': symbol})
         resp = self.session.get(f"{url}?{query_string}")
         resp.raise_for_status()
-        return resp.json()
+        return self._json(resp)
+
+    def get_all_open_orders(self, market_type: str = 'futures') -> Dict[str, list]:
+        """一次签名请求获取该市场全部挂单，按 symbol 分组"""
+        if market_type == 'spot':
+            url = f"{self.spot_base_url}/api/v3/openOrders"
+        else:
+            url = f"{self.futures_base_url}/fapi/v1/openOrders"
+        
+        query_string = self._sign({})
+        resp = self.session.get(f"{url}?{query_string}")
+        resp.raise_for_status()
+        
+        grouped = {}
+        for o in self._json(resp):
+            grouped.setdefault(o['symbol'], []).append(o)
+        return grouped
 
     def get_order_status(self, symbol: str, order_id: int, market_type: str = 'futures') -> dict:
         """查询订单状态"""
@@ -470,7 +1032,7 @@ class BinanceClient:
             query_string = self._sign(params)
             resp = self.session.get(f"{url}?{query_string}")
             resp.raise_for_status()
-            return resp.json()
+            return self._json(resp)
         except Exception as e:
             print(f"⚠️ 查询订单状态失败: {e}")
             return None
@@ -511,7 +1073,7 @@ class BinanceClient:
             print(f"❌ 现货下单失败: {resp.status_code} - {error_detail}")
             raise Exception(f"{error_detail}")
         
-        return resp.json()
+        return self._json(resp)
 
     def _create_futures_order(self, symbol: str, side: str, price: float, quantity: float,
                                 leverage: int = None, margin_type: str = None, position_side: str = None):
@@ -527,10 +1089,13 @@ class BinanceClient:
             except Exception as e:
                 print(f"   ⚠️ 设置杠杆失败: {e}")
         
-        # 设置保证金模式
+        # 设置保证金模式（查询返回 CROSS/ISOLATED，设置需要 CROSSED/ISOLATED）
         if margin_type:
             try:
-                self.set_margin_type(symbol, margin_type)
+                target = 'CROSSED' if margin_type.upper().startswith('CROSS') else margin_type.upper()
+                current = self.get_margin_type(symbol)
+                if not target.startswith(current):
+                    self.set_margin_type(symbol, target)
             except:
                 pass
         
@@ -570,7 +1135,7 @@ class BinanceClient:
             print(f"❌ 合约下单失败: {resp.status_code} - {error_detail}")
             raise Exception(f"{error_detail}")
         
-        return resp.json()
+        return self._json(resp)
 
     def cancel_order(self, symbol: str, order_id: int, market_type: str = 'futures'):
         """取消订单"""
@@ -586,17 +1151,324 @@ class BinanceClient:
         query_string = self._sign(params)
         resp = self.session.delete(f"{url}?{query_string}")
         resp.raise_for_status()
-        return resp.json()
+        return self._json(resp)
+
+
+@lru_cache(maxsize=1)
+def get_binance_client() -> BinanceClient:
+    """进程内共用一个客户端：同一连接池、K线/精度/杠杆等缓存"""
+    return BinanceClient()
+
+
+class KlineStream:
+    """
+    币安K线 WebSocket 推送（后台线程，单连接多路订阅）
+    K线收盘时回调 on_close(market_type, symbol, interval, open_time, close)
+    """
+    
+    STREAM_URLS = {
+        'spot': "wss://stream.binance.com:9443/stream?streams=",
+        'futures': "wss://fstream.binance.com/stream?streams=",
+    }
+    
+    def __init__(self, market_type: str, on_close, on_connect=None):
+        self.market_type = market_type
+        self.on_close = on_close
+        self.on_connect = on_connect
+        self._keys = frozenset()
+        self._live_keys = frozenset()
+        self._changed = threading.Event()
+        self._thread = None
+    
+    def subscribe(self, keys: set):
+        """设置订阅的 (symbol, interval) 集合，有变化时重连"""
+        keys = frozenset(keys)
+        if keys != self._keys:
+            self._keys = keys
+            self._changed.set()
+        
+        if self._thread is None and keys:
+            self._thread = threading.Thread(target=self._run, name=f"kline-{self.market_type}", daemon=True)
+            self._thread.start()
+    
+    def is_live(self, symbol: str, interval: str) -> bool:
+        """该K线当前是否由已连接的推送覆盖"""
+        return (symbol, interval) in self._live_keys
+    
+    def _run(self):
+        backoff = 1
+        while True:
+            keys = self._keys
+            self._changed.clear()
+            if not keys:
+                self._changed.wait()
+                continue
+            
+            streams = '/'.join(f"{symbol.lower()}@kline_{interval}" for symbol, interval in sorted(keys))
+            try:
+                with ws_connect(self.STREAM_URLS[self.market_type] + streams, open_timeout=10) as ws:
+                    if self.on_connect:
+                        self.on_connect(self.market_type)
+                    self._live_keys = keys
+                    backoff = 1
+                    
+                    while not self._changed.is_set():
+                        try:
+                            message = ws.recv(timeout=1)
+                        except TimeoutError:
+                            continue
+                        self._handle(orjson.loads(message))
+            except Exception as e:
+                print(f"⚠️ K线推送断开({self.market_type}): {e}")
+                self._changed.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                self._live_keys = frozenset()
+    
+    def _handle(self, message: dict):
+        kline = message.get('data', {}).get('k')
+        if not kline or not kline.get('x'):
+            return
+        self.on_close(self.market_type, kline['s'], kline['i'], int(kline['t']), float(kline['c']))
+
+
+class UserDataStream:
+    """
+    币安合约用户数据流（后台线程）
+    挂单进入终态时回调 on_update(symbol, order_id, status)；
+    （重）连上时以 (None, None, None) 回调，断线期间可能漏掉推送，需要补一轮检查
+    """
+    
+    URL = "wss://fstream.binance.com/ws/"
+    KEEPALIVE_INTERVAL = 30 * 60
+    FINAL_STATUSES = frozenset(['FILLED', 'CANCELED', 'EXPIRED', 'EXPIRED_IN_MATCH', 'REJECTED'])
+    
+    def __init__(self, client: BinanceClient, on_update):
+        self.client = client
+        self.on_update = on_update
+        self.live = False
+        self._thread = None
+    
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="user-data", daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        backoff = 1
+        while True:
+            try:
+                listen_key = self.client.new_listen_key()
+                with ws_connect(self.URL + listen_key, open_timeout=10) as ws:
+                    self.live = True
+                    backoff = 1
+                    self.on_update(None, None, None)
+                    keepalive_at = time.monotonic() + self.KEEPALIVE_INTERVAL
+                    
+                    while True:
+                        if time.monotonic() >= keepalive_at:
+                            self.client.keepalive_listen_key()
+                            keepalive_at = time.monotonic() + self.KEEPALIVE_INTERVAL
+                        try:
+                            message = ws.recv(timeout=1)
+                        except TimeoutError:
+                            continue
+                        event = orjson.loads(message)
+                        if event.get('e') == 'listenKeyExpired':
+                            break
+                        self._handle(event)
+            except Exception as e:
+                print(f"⚠️ 订单推送断开: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                self.live = False
+    
+    def _handle(self, event: dict):
+        if event.get('e') != 'ORDER_TRADE_UPDATE':
+            return
+        order = event.get('o', {})
+        if order.get('X') in self.FINAL_STATUSES:
+            self.on_update(order['s'], int(order['i']), order['X'])
 
 
 class EMATrailingBot:
     """EMA追踪机器人主程序"""
     
-    def __init__(self):
-        self.client = BinanceClient()
+    def __init__(self, client: Optional[BinanceClient] = None):
+        self.client = client or get_binance_client()
         self.price_threshold = 0.003  # 0.3% 避免频繁更新
+        # K线收盘或挂单进入终态即唤醒主循环，不必等到下一个检查周期；on_push 供外部另行调度
+        self._wakeup = threading.Event()
+        self._last_push = 0.0
+        self.on_push = None
+        self.client.on_kline_closed = self._on_push
+        self.client.on_order_update = self._on_push
+        # 上一轮: (开始时间, 结束时的 (id, 币安订单号) 集合)
+        self._last_cycle: Optional[tuple] = None
+        # 熔断: 订单 id -> (连续失败次数, 恢复处理的时间)；按订单计，同交易对的正常订单不受牵连
+        self._breakers: Dict[str, tuple] = {}
+        self._breakers_lock = threading.Lock()
+        # 本轮批量挂单快照: market_type -> (拉取时间, {symbol: [orders]})
+        self._open_orders_snapshot: Dict[str, tuple] = {}
+        # 非 None 时通知先暂存，本轮结束后合并发送
+        self._pending_notifications: Optional[List[str]] = None
+    
+    def _on_push(self, *args):
+        self._last_push = time.monotonic()
+        self._wakeup.set()
+        if self.on_push:
+            self.on_push()
+    
+    @staticmethod
+    def _orders_snapshot(orders: List[dict]) -> frozenset:
+        return frozenset((o['id'], o.get('binance_order_id')) for o in orders)
+    
+    def can_skip_cycle(self, orders: List[dict]) -> bool:
+        """
+        EMA 只在K线收盘时变化，挂单状态变化也有推送；
+        推送都在线、上轮之后没有新推送、订单没有增减且都已挂出时，本轮轮询可跳过，
+        但距上轮开始满 RECONCILE_INTERVAL 仍完整对账一次
+        """
+        last = self._last_cycle
+        if last is None:
+            return False
+        started, snapshot = last
+        if time.monotonic() - started >= RECONCILE_INTERVAL or self._last_push >= started:
+            return False
+        if any(o.get('binance_order_id') is None for o in orders) or self._orders_snapshot(orders) != snapshot:
+            return False
+        keys = {(o.get('market_type', 'futures'), o['symbol'], o['interval']) for o in orders}
+        return self.client.streams_cover(list(keys))
+    
+    def cycle_done(self, started: float, orders: List[dict]):
+        """
+        记录本轮开始时间与本轮实际处理的订单状态，供 can_skip_cycle 比较；
+        update_order 原地修改这些 dict，新的币安订单号也会反映在快照里。
+        处理期间新增的订单不在快照中，下一轮不会被跳过
+        """
+        self._last_cycle = (started, self._orders_snapshot(orders))
+    
+    def run_cycle(self, executor: Executor) -> Optional[tuple]:
+        """
+        跑一轮检查（阻塞），CLI 主循环与 Telegram 定时任务共用；各订单交给 executor 并发处理。
+        返回 (本轮订单, 各订单结果或异常, 本轮通知)，通知由调用方合并发送；无订单或可跳过时返回 None
+        """
+        # 一轮内的订单状态改动只改内存，本轮结束统一写盘
+        with OrderManager.batch():
+            orders = OrderManager.load_orders()
+            active = [o for o in orders if o.get('status') == 'active']
+            # 同一 市场+交易对+周期 的订单相邻处理，共用K线缓存
+            active.sort(key=lambda o: (o.get('market_type', 'futures'), o['symbol'], o['interval']))
+            if not active or self.can_skip_cycle(active):
+                return None
+            started = time.monotonic()
+            
+            self.prefetch(active)
+            # 各订单相互独立且耗时在网络往返，并发处理，本轮耗时约等于最慢的一单
+            with self.buffered_notifications() as notifications:
+                futures = [executor.submit(self.process_order, order) for order in active]
+                results = []
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append(e)
+            self.cycle_done(started, active)
+        return active, results, notifications
+    
+    def notify(self, message: str):
+        pending = self._pending_notifications
+        if pending is not None:
+            pending.append(message)
+        else:
+            send_telegram_message(message)
+    
+    @contextmanager
+    def buffered_notifications(self):
+        """期间 process_order 产生的通知收集到 yield 出的列表里，由调用方合并发送"""
+        pending: List[str] = []
+        self._pending_notifications = pending
+        try:
+            yield pending
+        finally:
+            self._pending_notifications = None
+    
+    def prefetch(self, orders: List[dict]):
+        """
+        本轮开始前订阅K线推送并并发拉取缺失的K线；
+        同一市场涉及的交易对多到批量请求权重更低时，一次性拉取全部挂单，逐单处理时不再各自请求
+        """
+        limits = {}
+        for o in orders:
+            key = (o.get('market_type', 'futures'), o['symbol'], o['interval'])
+            limits[key] = max(limits.get(key, 0), _klines_limit(o['ema']))
+        keys = list(limits)
+        self.client.watch_klines(keys)
+        if any(mt == 'futures' for mt, _, _ in keys):
+            self.client.watch_orders()
+        self.client.prefetch_closes(limits)
+        
+        self._open_orders_snapshot = {}
+        for market_type in MARKET_TYPES:
+            symbols = {symbol for mt, symbol, _ in keys if mt == market_type}
+            if len(symbols) < BATCH_OPEN_ORDERS_MIN_SYMBOLS[market_type]:
+                continue
+            try:
+                grouped = self.client.get_all_open_orders(market_type)
+                self._open_orders_snapshot[market_type] = (time.monotonic(), grouped)
+            except Exception as e:
+                print(f"⚠️ 批量获取挂单失败: {e}")
+    
+    def _get_open_orders(self, symbol: str, market_type: str) -> list:
+        """优先使用本轮批量拉取的挂单快照，过期或没有时单独请求"""
+        snapshot = self._open_orders_snapshot.get(market_type)
+        if snapshot and time.monotonic() - snapshot[0] < KLINES_CACHE_TTL:
+            return snapshot[1].get(symbol, [])
+        return self.client.get_open_orders(symbol, market_type)
+    
+    def forget_order(self, order_id: str):
+        """订单被移除追踪时清掉它的熔断记录"""
+        with self._breakers_lock:
+            self._breakers.pop(order_id, None)
+    
+    def _cancel_untracked(self, symbol: str, binance_order_id: int, market_type: str) -> str:
+        """下单期间订单已被删除（/remove）：撤掉刚挂出的单，不在币安留下无人追踪的挂单"""
+        try:
+            self.client.cancel_order(symbol, binance_order_id, market_type)
+        except Exception as e:
+            print(f"⚠️ 撤销未追踪订单失败 {symbol} {binance_order_id}: {e}")
+            return "⚠️ 已删除，撤单失败"
+        return "🗑️ 已删除"
     
     def process_order(self, order_config: dict) -> str:
+        """
+        处理单个订单；同一订单连续失败时暂停一段时间（熔断），
+        避免出错的订单每轮都打到币安、累积限频甚至触发 418 封禁
+        """
+        key = order_config['id']
+        remaining = self._breakers.get(key, (0, 0.0))[1] - time.monotonic()
+        if remaining > 0:
+            return f"⏸️ 熔断中 {remaining:.0f}s"
+        
+        result = self._process_order(order_config)
+        with self._breakers_lock:
+            if OrderManager.get_order(key) is None:
+                # 已成交移除或处理期间被删除，不再需要熔断记录
+                self._breakers.pop(key, None)
+            elif result.startswith(("❌", "⚠️")):
+                fails = self._breakers.get(key, (0, 0.0))[0] + 1
+                retry_at = 0.0
+                if fails >= BREAKER_THRESHOLD:
+                    backoff = min(BREAKER_MAX_BACKOFF, 30 * 2 ** (fails - BREAKER_THRESHOLD))
+                    retry_at = time.monotonic() + backoff
+                    print(f"⏸️ {key} 连续失败 {fails} 次，暂停 {backoff}s")
+                self._breakers[key] = (fails, retry_at)
+            else:
+                self._breakers.pop(key, None)
+        return result
+    
+    def _process_order(self, order_config: dict) -> str:
         """处理单个订单"""
         symbol = order_config['symbol']
         interval = order_config['interval']
@@ -621,11 +1493,9 @@ class EMATrailingBot:
             ema_price = self.client.calculate_ema(symbol, ema_period, interval, market_type)
             if ema_price == 0:
                 return "⚠️ EMA计算失败"
-            
-            current_price = self.client.get_current_price(symbol, market_type)
-            
+
             # 获取当前挂单列表
-            open_orders = self.client.get_open_orders(symbol, market_type)
+            open_orders = self._get_open_orders(symbol, market_type)
             our_order = None
             
             # 查找我们的订单
@@ -654,7 +1524,7 @@ class EMATrailingBot:
                             old_status = self.client.get_order_status(symbol, binance_order_id, market_type)
                             if old_status and old_status.get('status') == 'FILLED':
                                 OrderManager.remove_order(order_id)
-                                send_telegram_message(f"🎉 *{market_label}订单已成交*\n\nID: `{order_id}`")
+                                self.notify(f"🎉 *{market_label}订单已成交*\n\nID: `{order_id}`")
                                 return "🎉 已成交"
                         return f"⚠️ 取消失败"
                     
@@ -671,15 +1541,16 @@ class EMATrailingBot:
                         )
                         new_order_id = new_order['orderId']
                         
-                        OrderManager.update_order(order_id, 
+                        if not OrderManager.update_order(order_id, 
                             binance_order_id=new_order_id, 
                             notified_error=False
-                        )
+                        ):
+                            return self._cancel_untracked(symbol, new_order_id, market_type)
                         
                         diff_pct = ((ema_price - order_price) / order_price) * 100
                         arrow = "↑" if diff_pct > 0 else "↓"
                         
-                        send_telegram_message(
+                        self.notify(
                             f"🔄 *{market_label}订单已更新*\n\n"
                             f"ID: `{order_id}`\n"
                             f"{order_price:,.2f} → {ema_price:,.2f} ({arrow}{abs(diff_pct):.2f}%)"
@@ -692,10 +1563,10 @@ class EMATrailingBot:
                         print(f"   ❌ 创建失败: {error_msg[:100]}")
                         
                         if not notified:
-                            send_telegram_message(
+                            self.notify(
                                 f"⚠️ *订单更新失败*\n\n"
                                 f"ID: `{order_id}`\n"
-                                f"原因: {error_msg[:100]}"
+                                f"原因: {escape_markdown(error_msg[:100])}"
                             )
                             OrderManager.set_notified(order_id, True)
                         
@@ -718,7 +1589,7 @@ class EMATrailingBot:
                         
                         # 已完全成交 - 移除追踪
                         if status == 'FILLED':
-                            send_telegram_message(f"🎉 *{market_label}订单已成交!*\n\nID: `{order_id}`")
+                            self.notify(f"🎉 *{market_label}订单已成交!*\n\nID: `{order_id}`")
                             OrderManager.remove_order(order_id)
                             return "🎉 已成交"
                         
@@ -748,12 +1619,13 @@ class EMATrailingBot:
                         position_side=position_side,
                         market_type=market_type
                     )
-                    OrderManager.update_order(order_id,
+                    if not OrderManager.update_order(order_id,
                         binance_order_id=new_order['orderId'],
                         notified_error=False
-                    )
+                    ):
+                        return self._cancel_untracked(symbol, new_order['orderId'], market_type)
                     
-                    send_telegram_message(
+                    self.notify(
                         f"📌 *新{market_label}订单已创建*\n\n"
                         f"ID: `{order_id}`\n"
                         f"价格: `{ema_price:,.2f}`"
@@ -766,10 +1638,10 @@ class EMATrailingBot:
                     print(f"❌ 创建失败: {error_msg[:100]}")
                     
                     if not notified:
-                        send_telegram_message(
+                        self.notify(
                             f"⚠️ *创建订单失败*\n\n"
                             f"ID: `{order_id}`\n"
-                            f"原因: {error_msg[:100]}"
+                            f"原因: {escape_markdown(error_msg[:100])}"
                         )
                         OrderManager.set_notified(order_id, True)
                     
@@ -780,7 +1652,7 @@ class EMATrailingBot:
             print(f"❌ {order_id}: {error_msg[:50]}")
             
             if not notified:
-                send_telegram_message(f"⚠️ *处理错误*\n\nID: `{order_id}`\n{error_msg[:100]}")
+                self.notify(f"⚠️ *处理错误*\n\nID: `{order_id}`\n{escape_markdown(error_msg[:100])}")
                 OrderManager.set_notified(order_id, True)
             
             return f"❌ 错误"
@@ -794,20 +1666,23 @@ class EMATrailingBot:
         if TELEGRAM_TOKEN:
             send_telegram_message(f"🚀 *机器人已启动*\n\n支持现货+合约\n每{check_interval}秒检查")
         
+        executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="order")
         while True:
             try:
-                orders = OrderManager.load_orders()
-                active_orders = [o for o in orders if o.get('status') == 'active']
-                
-                if active_orders:
+                cycle = self.run_cycle(executor)
+                if cycle:
+                    active_orders, results, notifications = cycle
                     spot_count = len([o for o in active_orders if o.get('market_type') == 'spot'])
                     fut_count = len(active_orders) - spot_count
                     print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 现货:{spot_count} 合约:{fut_count}")
-                    
-                    for order in active_orders:
+                    for order, result in zip(active_orders, results):
                         market_icon = "🔵" if order.get('market_type') == 'spot' else "🟡"
-                        result = self.process_order(order)
                         print(f"  {market_icon} {order['id']}: {result}")
+                    # 本轮通知合并发送，分段之间间隔 1 秒，避免触发 Telegram 限频
+                    for i, chunk in enumerate(chunk_notifications(notifications)):
+                        if i:
+                            time.sleep(1)
+                        send_telegram_message(chunk)
                 
             except KeyboardInterrupt:
                 print("\n⏹️ 停止")
@@ -815,7 +1690,8 @@ class EMATrailingBot:
             except Exception as e:
                 print(f"❌ {e}")
             
-            time.sleep(check_interval)
+            self._wakeup.wait(check_interval)
+            self._wakeup.clear()
 
 
 def print_help():
@@ -864,21 +1740,19 @@ def cmd_remove(args):
         return
     
     order_id = args[0]
-    orders = OrderManager.load_orders()
-    
-    for o in orders:
-        if o['id'] == order_id and o.get('binance_order_id'):
-            try:
-                client = BinanceClient()
-                market_type = o.get('market_type', 'futures')
-                client.cancel_order(o['symbol'], o['binance_order_id'], market_type)
-            except:
-                pass
-    
-    if OrderManager.remove_order(order_id):
-        print(f"✅ 已删除: {order_id}")
-    else:
+    # 先取消追踪再撤单，与 Telegram /remove 一致
+    o = OrderManager.get_order(order_id)
+    if not OrderManager.remove_order(order_id):
         print(f"❌ 不存在")
+        return
+    
+    if o.get('binance_order_id'):
+        try:
+            market_type = o.get('market_type', 'futures')
+            get_binance_client().cancel_order(o['symbol'], o['binance_order_id'], market_type)
+        except:
+            pass
+    print(f"✅ 已删除: {order_id}")
 
 
 def cmd_ema(args):
@@ -886,24 +1760,20 @@ def cmd_ema(args):
         print("用法: python ema_bot.py ema <币种> <周期> [spot/futures]")
         return
     
-    symbol = args[0].upper()
-    if not symbol.endswith('USDT'):
-        symbol += 'USDT'
-    
-    interval = INTERVAL_MAP.get(args[1].lower(), args[1])
+    symbol, interval = normalize_args(args[0], args[1])
     market_type = args[2].lower() if len(args) > 2 else 'futures'
     
     if market_type not in MARKET_TYPES:
         print(f"❌ market_type 须为 {MARKET_TYPES}")
         return
     
-    client = BinanceClient()
+    client = get_binance_client()
     price = client.get_current_price(symbol, market_type)
     market_label = "现货" if market_type == 'spot' else "合约"
     
     print(f"\n{market_label} {symbol} ({interval}) = {price:.2f}")
-    for ema in SUPPORTED_EMA:
-        val = client.calculate_ema(symbol, ema, interval, market_type)
+    emas = client.calculate_emas(symbol, SUPPORTED_EMA, interval, market_type)
+    for ema, val in emas.items():
         diff = ((price - val) / val) * 100
         print(f"  EMA{ema}: {val:.2f} ({diff:+.2f}%)")
 
@@ -913,13 +1783,11 @@ def cmd_price(args):
         print("用法: python ema_bot.py price <币种> [spot/futures]")
         return
     
-    symbol = args[0].upper()
-    if not symbol.endswith('USDT'):
-        symbol += 'USDT'
+    symbol, _ = normalize_args(args[0])
     
     market_type = args[1].lower() if len(args) > 1 else 'futures'
     
-    client = BinanceClient()
+    client = get_binance_client()
     price = client.get_current_price(symbol, market_type)
     market_label = "现货" if market_type == 'spot' else "合约"
     print(f"💰 {market_label} {symbol}: {price:,.2f}")
@@ -928,7 +1796,7 @@ def cmd_price(args):
 def cmd_balance(args):
     market_type = args[0].lower() if len(args) > 0 else 'futures'
     
-    client = BinanceClient()
+    client = get_binance_client()
     balances = client.get_account_balance(market_type)
     market_label = "现货" if market_type == 'spot' else "合约"
     
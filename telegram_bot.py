@@ -2,13 +2,25 @@ import os
 import sys
 import json
 import asyncio
+import atexit
 import logging
-from datetime import datetime
+import queue
+import re
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatAction
+from telegram.error import BadRequest
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     CallbackQueryHandler,
@@ -18,20 +30,29 @@ from telegram.ext import (
 )
 
 from ema_bot import (
-    BinanceClient, OrderManager, SUPPORTED_EMA, INTERVAL_MAP, 
-    EMATrailingBot, MARKET_TYPES
+    OrderManager, SUPPORTED_EMA, 
+    EMATrailingBot, MARKET_TYPES, normalize_args, get_binance_client, chunk_notifications,
+    split_message
 )
 
 load_dotenv()
 
-logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# 日志先进队列，由后台线程写出，事件循环里不做日志 I/O
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.basicConfig(handlers=[QueueHandler(_log_queue)], level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+# 配置公网地址后改用 Webhook 接收更新（需反向代理终止 TLS），否则长轮询
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 
 if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
     print("❌ 请配置 TELEGRAM_TOKEN 和 TELEGRAM_CHAT_ID")
@@ -39,39 +60,104 @@ if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
 
 AUTHORIZED_CHAT_ID = int(TELEGRAM_CHAT_ID)
 
-binance_client = BinanceClient()
+binance_client = get_binance_client()
 trailing_bot = None
 bot_running = False
+# 以下 asyncio 对象在 post_init 里、事件循环运行后创建，保证绑定的是实际运行的循环（含 uvloop）
+# 定时轮询与K线收盘触发可能同时到来，同一时间只跑一轮
+_trailing_lock: Optional[asyncio.Lock] = None
+# 一轮内同时处理的订单数上限（专用线程池大小），避免瞬时请求过多触发币安限频
+TRAILING_CONCURRENCY = 10
+_trailing_executor = ThreadPoolExecutor(max_workers=TRAILING_CONCURRENCY, thread_name_prefix="trailing")
+
+# 查询类命令先回“正在输入”，币安请求交给后台 worker，处理函数立即返回
+QUERY_WORKERS = 4
+QUERY_QUEUE_SIZE = 200
+query_queue: Optional[asyncio.Queue] = None
+
+# 回调数据格式，PTB 匹配后通过 context.matches 传入，回调内不再 split
+# 绑定按钮只带 列表令牌+序号，订单详情按令牌存放在 user_data['bind_choices']，回调数据远小于 64 字节上限；
+# 令牌区分每次 /bind 的列表，旧键盘上的按钮不会错绑到新列表的同序号订单
+BIND_CALLBACK_RE = re.compile(r"^bind_(?P<token>[0-9a-f]+)_(?P<idx>\d+)$")
+REMOVE_CALLBACK_RE = re.compile(r"^rm_(?P<id>.+)$")
+
+MARKET_LABELS = {'spot': "🔵现货", 'futures': "🟡合约"}
+
+# 只处理命令消息和按钮回调，其余类型由 Telegram 服务端过滤掉
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# /bind 列出的挂单暂存在 user_data 里，点按钮时在有效期内直接使用，过期则重新确认订单仍在
+OPEN_ORDERS_CACHE_TTL = 30
+# 超过此时长的 /bind 列表按钮失效、提示重新 /bind，并在下次 /bind 时清理
+BIND_CHOICES_TTL = 600
+
+# 同一按钮短时间内重复点击只处理一次: "chat_id:callback_data" -> 上次处理时间
+CALLBACK_DEBOUNCE = 2.0
+_recent_callbacks = {}
+
+HELP_TEXT = (
+    "🤖 *EMA追踪机器人* (支持现货+合约)\n\n"
+    "📌 *绑定订单*\n"
+    "/bind \\[币种] \\[周期] \\[EMA] - 绑定合约订单\n"
+    "/bind\\_spot \\[币种] \\[周期] \\[EMA] - 绑定现货订单\n\n"
+    "📊 *查询*\n"
+    "/list - 查看所有订单\n"
+    "/ema \\[币种] \\[周期] - 合约EMA\n"
+    "/ema\\_spot \\[币种] \\[周期] - 现货EMA\n"
+    "/price \\[币种] - 合约价格\n"
+    "/price\\_spot \\[币种] - 现货价格\n"
+    "/balance - 合约余额\n"
+    "/balance\\_spot - 现货余额\n\n"
+    "⚙️ *控制*\n"
+    "/remove \\[ID] - 删除订单\n"
+    "/status - 运行状态\n"
+    "/start\\_bot - 启动追踪\n"
+    "/stop\\_bot - 停止追踪"
+)
 
 
 def is_authorized(chat_id: int) -> bool:
     return chat_id == AUTHORIZED_CHAT_ID
 
 
+def is_duplicate_callback(update: Update) -> bool:
+    now = time.monotonic()
+    key = f"{update.effective_chat.id}:{update.callback_query.data}"
+    if now - _recent_callbacks.get(key, float('-inf')) < CALLBACK_DEBOUNCE:
+        return True
+    for old_key, ts in list(_recent_callbacks.items()):
+        if now - ts > 10:
+            del _recent_callbacks[old_key]
+    _recent_callbacks[key] = now
+    return False
+
+
+async def enqueue_query(update: Update, job):
+    """把查询排进后台队列；job 为无参协程函数"""
+    try:
+        query_queue.put_nowait(job)
+    except asyncio.QueueFull:
+        await update.message.reply_text("⏳ 请求过多，请稍后再试")
+        return
+    await update.message.chat.send_action(ChatAction.TYPING)
+
+
+async def query_worker():
+    while True:
+        job = await query_queue.get()
+        try:
+            await job()
+        except Exception as e:
+            logger.error("查询失败: %s", e)
+        finally:
+            query_queue.task_done()
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_authorized(update.effective_chat.id):
         return
     
-    await update.message.reply_text(
-        "🤖 *EMA追踪机器人* (支持现货+合约)\n\n"
-        "📌 *绑定订单*\n"
-        "/bind \\[币种] \\[周期] \\[EMA] - 绑定合约订单\n"
-        "/bind\\_spot \\[币种] \\[周期] \\[EMA] - 绑定现货订单\n\n"
-        "📊 *查询*\n"
-        "/list - 查看所有订单\n"
-        "/ema \\[币种] \\[周期] - 合约EMA\n"
-        "/ema\\_spot \\[币种] \\[周期] - 现货EMA\n"
-        "/price \\[币种] - 合约价格\n"
-        "/price\\_spot \\[币种] - 现货价格\n"
-        "/balance - 合约余额\n"
-        "/balance\\_spot - 现货余额\n\n"
-        "⚙️ *控制*\n"
-        "/remove \\[ID] - 删除订单\n"
-        "/status - 运行状态\n"
-        "/start\\_bot - 启动追踪\n"
-        "/stop\\_bot - 停止追踪",
-        parse_mode='Markdown'
-    )
+    await update.message.reply_text(HELP_TEXT, parse_mode='Markdown')
 
 
 # ==================== EMA 查询 ====================
@@ -94,19 +180,22 @@ async def _cmd_ema_impl(update: Update, context: ContextTypes.DEFAULT_TYPE, mark
         await update.message.reply_text("用法: /ema BTC 4h")
         return
     
-    symbol = context.args[0].upper()
-    if not symbol.endswith('USDT'):
-        symbol += 'USDT'
-    
-    interval = INTERVAL_MAP.get(context.args[1].lower(), context.args[1])
-    market_label = "🔵现货" if market_type == 'spot' else "🟡合约"
+    symbol, interval = normalize_args(context.args[0], context.args[1])
+    await enqueue_query(update, partial(_reply_ema, update, symbol, interval, market_type))
+
+
+async def _reply_ema(update: Update, symbol: str, interval: str, market_type: str):
+    market_label = MARKET_LABELS[market_type]
     
     try:
-        price = binance_client.get_current_price(symbol, market_type)
+        # 现价与K线互不依赖，两个请求并发发出，耗时取较慢的一个
+        price, emas = await asyncio.gather(
+            asyncio.to_thread(binance_client.get_current_price, symbol, market_type),
+            asyncio.to_thread(binance_client.calculate_emas, symbol, SUPPORTED_EMA, interval, market_type),
+        )
         lines = [f"📊 {market_label} *{symbol}* ({interval}) = `{price:,.2f}`\n"]
         
-        for ema in SUPPORTED_EMA:
-            val = binance_client.calculate_ema(symbol, ema, interval, market_type)
+        for ema, val in emas.items():
             # ✅ 新增：检查 EMA 是否有效
             if val == 0 or val is None:
                 lines.append(f"EMA{ema}: 数据不足")
@@ -140,14 +229,16 @@ async def _cmd_price_impl(update: Update, context: ContextTypes.DEFAULT_TYPE, ma
         await update.message.reply_text("用法: /price BTC")
         return
     
-    symbol = context.args[0].upper()
-    if not symbol.endswith('USDT'):
-        symbol += 'USDT'
+    symbol, _ = normalize_args(context.args[0])
     
-    market_label = "🔵现货" if market_type == 'spot' else "🟡合约"
+    await enqueue_query(update, partial(_reply_price, update, symbol, market_type))
+
+
+async def _reply_price(update: Update, symbol: str, market_type: str):
+    market_label = MARKET_LABELS[market_type]
     
     try:
-        price = binance_client.get_current_price(symbol, market_type)
+        price = await asyncio.to_thread(binance_client.get_current_price, symbol, market_type)
         await update.message.reply_text(f"💰 {market_label} {symbol}: `{price:,.2f}`", parse_mode='Markdown')
     except Exception as e:
         await update.message.reply_text(f"❌ {e}")
@@ -169,21 +260,28 @@ async def _cmd_balance_impl(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if not is_authorized(update.effective_chat.id):
         return
     
-    market_label = "🔵现货" if market_type == 'spot' else "🟡合约"
+    await enqueue_query(update, partial(_reply_balance, update, market_type))
+
+
+async def _reply_balance(update: Update, market_type: str):
+    market_label = MARKET_LABELS[market_type]
     
     try:
-        balances = binance_client.get_account_balance(market_type)
+        balances = await asyncio.to_thread(binance_client.get_account_balance, market_type)
         
         if not balances:
             await update.message.reply_text(f"💰 {market_label}余额: 无")
             return
         
         lines = [f"💰 *{market_label}余额*\n"]
-        for asset, amount in balances.items():
-            if amount > 0.0001:
-                lines.append(f"`{asset}`: {amount:,.4f}")
+        # 按数量从大到小全部列出，超过 4096 字符时分成多条发送
+        lines.extend(
+            f"`{asset}`: {amount:,.4f}"
+            for asset, amount in sorted(balances.items(), key=lambda kv: -kv[1])
+        )
         
-        await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+        for chunk in split_message(lines):
+            await update.message.reply_text(chunk, parse_mode='Markdown')
     except Exception as e:
         await update.message.reply_text(f"❌ {e}")
 
@@ -215,11 +313,7 @@ async def _cmd_bind_impl(update: Update, context: ContextTypes.DEFAULT_TYPE, mar
         )
         return
     
-    symbol = context.args[0].upper()
-    if not symbol.endswith('USDT'):
-        symbol += 'USDT'
-    
-    interval = INTERVAL_MAP.get(context.args[1].lower(), context.args[1])
+    symbol, interval = normalize_args(context.args[0], context.args[1])
     
     try:
         ema = int(context.args[2])
@@ -231,7 +325,7 @@ async def _cmd_bind_impl(update: Update, context: ContextTypes.DEFAULT_TYPE, mar
         return
     
     try:
-        open_orders = binance_client.get_open_orders(symbol, market_type)
+        open_orders = await asyncio.to_thread(binance_client.get_open_orders, symbol, market_type)
         
         if not open_orders:
             await update.message.reply_text(f"❌ 未找到 {symbol} {market_label}挂单")
@@ -240,14 +334,26 @@ async def _cmd_bind_impl(update: Update, context: ContextTypes.DEFAULT_TYPE, mar
         if len(open_orders) == 1:
             await bind_order(update, open_orders[0], symbol, interval, ema, market_type)
         else:
+            listings = context.user_data.setdefault('bind_choices', {})
+            now = time.monotonic()
+            for old_token in [t for t, c in listings.items() if now - c['ts'] > BIND_CHOICES_TTL]:
+                del listings[old_token]
+            token = secrets.token_hex(4)
+            listings[token] = {
+                'ts': now,
+                'orders': open_orders,
+                'symbol': symbol,
+                'interval': interval,
+                'ema': ema,
+                'market_type': market_type,
+            }
             keyboard = []
-            for o in open_orders:
+            for i, o in enumerate(open_orders):
                 icon = "🟢" if o['side'] == 'BUY' else "🔴"
                 ps = o.get('positionSide', '')
                 ps_text = f" {ps}" if ps and ps != 'BOTH' else ""
                 text = f"{icon} {o['side']}{ps_text} @ {float(o['price']):,.2f}"
-                callback_data = f"bind_{market_type}_{o['orderId']}_{symbol}_{interval}_{ema}"
-                keyboard.append([InlineKeyboardButton(text, callback_data=callback_data)])
+                keyboard.append([InlineKeyboardButton(text, callback_data=f"bind_{token}_{i}")])
             
             await update.message.reply_text(
                 f"选择要绑定的{market_label}订单:", 
@@ -271,8 +377,8 @@ async def bind_order(update, binance_order: dict, symbol: str, interval: str, em
     # ✅ 修复：market_type 判断用 'futures' 而不是 'future'
     if market_type == 'futures':
         try:
-            leverage = binance_client.get_leverage(symbol)
-            margin_type = binance_client.get_margin_type(symbol)
+            leverage = await asyncio.to_thread(binance_client.get_leverage, symbol)
+            margin_type = await asyncio.to_thread(binance_client.get_margin_type, symbol)
             if not position_side: position_side = 'BOTH'
         except:
             pass
@@ -282,25 +388,18 @@ async def bind_order(update, binance_order: dict, symbol: str, interval: str, em
     tracking_id = f"{market_prefix}_{symbol}_{interval}_EMA{ema}_{side}"
     
     try:
-        orders = OrderManager.load_orders()
-        exists = False
-        
-        for o in orders:
-            if o['id'] == tracking_id:
-                exists = True
-                OrderManager.update_order(tracking_id,
-                    binance_order_id=binance_oid,
-                    quantity=quantity,
-                    leverage=leverage,
-                    margin_type=margin_type,
-                    position_side=position_side,
-                    market_type=market_type,
-                    status='active',
-                    notified_error=False
-                )
-                break
-        
-        if not exists:
+        if OrderManager.get_order(tracking_id) is not None:
+            OrderManager.update_order(tracking_id,
+                binance_order_id=binance_oid,
+                quantity=quantity,
+                leverage=leverage,
+                margin_type=margin_type,
+                position_side=position_side,
+                market_type=market_type,
+                status='active',
+                notified_error=False
+            )
+        else:
             new_order = {
                 'id': tracking_id,
                 'symbol': symbol,
@@ -311,16 +410,17 @@ async def bind_order(update, binance_order: dict, symbol: str, interval: str, em
                 'market_type': market_type,
                 'binance_order_id': binance_oid,
                 'status': 'active',
-                'created_at': datetime.now().isoformat(),
+                'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
                 'leverage': leverage,
                 'margin_type': margin_type,
                 'position_side': position_side,
                 'notified_error': False
             }
+            orders = OrderManager.load_orders()
             orders.append(new_order)
             OrderManager.save_orders(orders)
         
-        ema_price = binance_client.calculate_ema(symbol, ema, interval, market_type)
+        ema_price = await asyncio.to_thread(binance_client.calculate_ema, symbol, ema, interval, market_type)
         
         # ✅ 修复：构建消息时转义下划线，或使用 HTML 格式
         market_label = "SPOT" if market_type == 'spot' else "FUTURES"
@@ -352,32 +452,37 @@ async def bind_order(update, binance_order: dict, symbol: str, interval: str, em
 
 async def bind_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if is_duplicate_callback(update):
+        await query.answer("处理中…")
+        return
     await query.answer()
     
-    if not query.data.startswith("bind_"):
+    # bind_{令牌}_{序号}，令牌对应某一次 /bind 列出的挂单
+    fields = context.matches[0].groupdict()
+    idx = int(fields['idx'])
+    choices = context.user_data.get('bind_choices', {}).get(fields['token'])
+    if not choices or idx >= len(choices['orders']) or time.monotonic() - choices['ts'] > BIND_CHOICES_TTL:
+        await query.edit_message_text("❌ 选项已失效，请重新 /bind")
         return
     
-    # bind_{market_type}_{order_id}_{symbol}_{interval}_{ema}
-    parts = query.data.split("_")
-    market_type = parts[1]
-    order_id = int(parts[2])
-    symbol = parts[3]
-    interval = parts[4]
-    ema = int(parts[5])
+    target = choices['orders'][idx]
+    symbol = choices['symbol']
+    interval = choices['interval']
+    ema = choices['ema']
+    market_type = choices['market_type']
     
     try:
-        open_orders = binance_client.get_open_orders(symbol, market_type)
-        target = None
-        for o in open_orders:
-            if o['orderId'] == order_id:
-                target = o
-                break
+        if time.monotonic() - choices['ts'] >= OPEN_ORDERS_CACHE_TTL:
+            open_orders = await asyncio.to_thread(binance_client.get_open_orders, symbol, market_type)
+            target = next((o for o in open_orders if o['orderId'] == target['orderId']), None)
         
         if not target:
             await query.edit_message_text("❌ 订单不存在或已成交")
             return
         
         await bind_order(update, target, symbol, interval, ema, market_type)
+        # 绑定后键盘已被结果消息替换，该列表用完即弃
+        context.user_data['bind_choices'].pop(fields['token'], None)
     except Exception as e:
         await query.edit_message_text(f"❌ {e}")
 
@@ -396,28 +501,33 @@ async def cmd_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     lines = ["📋 *订单列表*\n"]
     
-    # 分类显示
-    spot_orders = [o for o in orders if o.get('market_type') == 'spot']
-    futures_orders = [o for o in orders if o.get('market_type', 'futures') == 'futures']
+    # 分类显示（一次遍历分桶）
+    buckets = {'spot': [], 'futures': []}
+    for o in orders:
+        buckets['spot' if o.get('market_type') == 'spot' else 'futures'].append(o)
+    spot_orders = buckets['spot']
+    futures_orders = buckets['futures']
     
+    # 每个订单的两行作为一个整体，分段时不会被拆开
     if spot_orders:
         lines.append("🔵 *现货*")
-        for o in spot_orders:
-            icon = "📈" if o['side'] == 'BUY' else "📉"
-            lines.append(f"{icon} `{o['id']}`")
-            lines.append(f"   {o['quantity']}")
+        lines.extend(
+            f"{'📈' if o['side'] == 'BUY' else '📉'} `{o['id']}`\n   {o['quantity']}"
+            for o in spot_orders
+        )
         lines.append("")
     
     if futures_orders:
         lines.append("🟡 *合约*")
-        for o in futures_orders:
-            icon = "📈" if o['side'] == 'BUY' else "📉"
-            ps = o.get('position_side', '-')
-            lv = o.get('leverage', '-')
-            lines.append(f"{icon} `{o['id']}`")
-            lines.append(f"   {o['quantity']} | {lv}x | {ps}")
+        lines.extend(
+            f"{'📈' if o['side'] == 'BUY' else '📉'} `{o['id']}`\n"
+            f"   {o['quantity']} | {o.get('leverage', '-')}x | {o.get('position_side', '-')}"
+            for o in futures_orders
+        )
     
-    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+    # 订单很多时超过 4096 字符上限，按行分成多条发送
+    for chunk in split_message(lines):
+        await update.message.reply_text(chunk, parse_mode='Markdown')
 
 
 async def cmd_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -444,16 +554,19 @@ async def cmd_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def do_remove(update, order_id: str):
-    orders = OrderManager.load_orders()
-    for o in orders:
-        if o['id'] == order_id and o.get('binance_order_id'):
-            try:
-                market_type = o.get('market_type', 'futures')
-                binance_client.cancel_order(o['symbol'], o['binance_order_id'], market_type)
-            except:
-                pass
-    
+    # 先取消追踪再撤单：此后追踪线程不会再改这条订单（新挂的单由它自己撤掉），
+    # 撤的是删除那一刻记录的币安订单号，不会漏掉处理中刚换上的新单
+    o = OrderManager.get_order(order_id)
     success = OrderManager.remove_order(order_id)
+    if success and trailing_bot:
+        trailing_bot.forget_order(order_id)
+    if success and o.get('binance_order_id'):
+        try:
+            market_type = o.get('market_type', 'futures')
+            await asyncio.to_thread(binance_client.cancel_order, o['symbol'], o['binance_order_id'], market_type)
+        except:
+            pass
+    
     msg = f"✅ 已删除" if success else f"❌ 不存在"
     
     if hasattr(update, 'callback_query') and update.callback_query:
@@ -464,10 +577,12 @@ async def do_remove(update, order_id: str):
 
 async def remove_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
+    if is_duplicate_callback(update):
+        await query.answer("处理中…")
+        return
     await query.answer()
     
-    if query.data.startswith("rm_"):
-        await do_remove(update, query.data[3:])
+    await do_remove(update, context.matches[0].group('id'))
 
 
 # ==================== 机器人控制 ====================
@@ -477,11 +592,9 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     global bot_running
-    orders = OrderManager.list_orders()
-    active = [o for o in orders if o.get('status') == 'active']
-    
-    spot_count = len([o for o in active if o.get('market_type') == 'spot'])
-    fut_count = len(active) - spot_count
+    counts = OrderManager.counts()
+    spot_count = counts['active_spot']
+    fut_count = counts['active_futures']
     
     status = "🟢 运行中" if bot_running else "🔴 停止"
     await update.message.reply_text(
@@ -499,21 +612,52 @@ async def run_trailing_bot(context: ContextTypes.DEFAULT_TYPE):
         return
     
     if not trailing_bot:
-        trailing_bot = EMATrailingBot()
+        trailing_bot = EMATrailingBot(binance_client)
     
-    try:
-        orders = OrderManager.load_orders()
-        active = [o for o in orders if o.get('status') == 'active']
-        
-        for order in active:
-            try:
-                result = trailing_bot.process_order(order)
+    if _trailing_lock.locked():
+        return
+    
+    async with _trailing_lock:
+        try:
+            # 币安请求是阻塞的，整轮放到线程里跑，订单在专用线程池并发处理，不卡住 Telegram 事件循环
+            cycle = await asyncio.to_thread(trailing_bot.run_cycle, _trailing_executor)
+            if not cycle:
+                return
+            active, results, notifications = cycle
+            
+            # 本轮结果按内容分组合并为一条日志，出错的订单单独记 error
+            groups = {}
+            for order, result in zip(active, results):
+                if isinstance(result, Exception):
+                    logger.error("%s: %s", order['id'], result)
+                    continue
                 market_icon = "🔵" if order.get('market_type') == 'spot' else "🟡"
-                logger.info(f"{market_icon} {order['id']}: {result}")
-            except Exception as e:
-                logger.error(f"{order['id']}: {e}")
-    except Exception as e:
-        logger.error(f"错误: {e}")
+                groups.setdefault(result, []).append(f"{market_icon} {order['id']}")
+            if groups:
+                logger.info("本轮结果:\n%s", "\n".join(
+                    f"{result}: {', '.join(ids)}" for result, ids in groups.items()
+                ))
+            
+            # 本轮通知合并成少量消息经 bot 发出（走限速器，429 时按 retry_after 重试）
+            # 每段单独发送：一段失败不影响其余；Markdown 解析失败时退回纯文本重发
+            for i, chunk in enumerate(chunk_notifications(notifications)):
+                if i:
+                    await asyncio.sleep(1)
+                try:
+                    try:
+                        await context.bot.send_message(chat_id=AUTHORIZED_CHAT_ID, text=chunk, parse_mode='Markdown')
+                    except BadRequest:
+                        await context.bot.send_message(chat_id=AUTHORIZED_CHAT_ID, text=chunk)
+                except Exception as e:
+                    logger.error("通知发送失败: %s", e)
+        except Exception as e:
+            logger.error("错误: %s", e)
+
+
+def _schedule_trailing(application: Application):
+    """K线收盘或挂单成交/撤销后立即补一轮检查（已有待执行的一轮则合并）"""
+    if bot_running and not application.job_queue.get_jobs_by_name('trailing_push'):
+        application.job_queue.run_once(run_trailing_bot, when=0, name='trailing_push')
 
 
 async def cmd_start_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -549,16 +693,31 @@ async def cmd_stop_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def post_init(application: Application):
-    global bot_running
+    global bot_running, trailing_bot, _trailing_lock, query_queue
+    _trailing_lock = asyncio.Lock()
+    query_queue = asyncio.Queue(maxsize=QUERY_QUEUE_SIZE)
     bot_running = True
     
+    # K线/订单推送在后台线程回调，切回事件循环后调度一轮检查；
+    # 60 秒定时任务保留作兜底，推送都在线时由 can_skip_cycle 降为每 5 分钟对账一次
+    trailing_bot = EMATrailingBot(binance_client)
+    loop = asyncio.get_running_loop()
+    trailing_bot.on_push = lambda: loop.call_soon_threadsafe(_schedule_trailing, application)
+    
     application.job_queue.run_repeating(run_trailing_bot, interval=60, first=10, name='trailing')
     
+    for _ in range(QUERY_WORKERS):
+        application.create_task(query_worker())
+    
+    # 后台预热：建立连接池、订阅K线推送并拉取在追踪订单的K线，首轮检查直接命中缓存
+    active = [o for o in OrderManager.load_orders() if o.get('status') == 'active']
+    if active:
+        application.create_task(asyncio.to_thread(trailing_bot.prefetch, active))
+    
     try:
-        orders = OrderManager.load_orders()
-        active = [o for o in orders if o.get('status') == 'active']
-        spot_count = len([o for o in active if o.get('market_type') == 'spot'])
-        fut_count = len(active) - spot_count
+        counts = OrderManager.counts()
+        spot_count = counts['active_spot']
+        fut_count = counts['active_futures']
         
         await application.bot.send_message(
             chat_id=AUTHORIZED_CHAT_ID,
@@ -566,7 +725,7 @@ async def post_init(application: Application):
                  f"支持现货+合约\n"
                  f"🔵 现货: {spot_count}\n"
                  f"🟡 合约: {fut_count}\n\n"
-                 f"每60秒检查一次订单",
+                 f"K线收盘即时检查，每60秒兜底",
             parse_mode='Markdown'
         )
     except:
@@ -576,7 +735,23 @@ async def post_init(application: Application):
 def main():
     print("🚀 启动机器人 (支持现货+合约)...")
     
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    # 装了 uvloop 就用它作事件循环（Windows 不支持），没装照常用标准 asyncio
+    if sys.platform != 'win32':
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
+    
+    # 发送限速：全局 30 条/秒、单聊 1 条/秒，遇到 429 按 retry_after 自动重试
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3))
+        # 每个更新独立成任务处理，一条慢请求不会挡住后面的命令（仅授权单个聊天，无顺序问题）
+        .concurrent_updates(True)
+        .build()
+    )
     application.post_init = post_init
     
     # 基础命令
@@ -609,11 +784,22 @@ def main():
     application.add_handler(CommandHandler("stop_bot", cmd_stop_bot))
     
     # 回调处理
-    application.add_handler(CallbackQueryHandler(bind_callback, pattern="^bind_"))
-    application.add_handler(CallbackQueryHandler(remove_callback, pattern="^rm_"))
+    application.add_handler(CallbackQueryHandler(bind_callback, pattern=BIND_CALLBACK_RE))
+    application.add_handler(CallbackQueryHandler(remove_callback, pattern=REMOVE_CALLBACK_RE))
     
     print("✅ 已启动")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL and '--polling' not in sys.argv:
+        url_path = TELEGRAM_TOKEN.split(':')[-1]
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.getenv('PORT', 8443)),
+            url_path=url_path,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{url_path}",
+            allowed_updates=ALLOWED_UPDATES
+        )
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":